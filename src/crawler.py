@@ -1,16 +1,173 @@
 
 import os
+import queue
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import orjson
 import requests
-import psycopg2
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import psycopg
 from dotenv import load_dotenv
-from datetime import datetime, timezone # Added import for datetime and timezone
+from datetime import datetime
 
 # Load environment variables from .env file
 load_dotenv()
 
+# GitHub search returns at most this many results per query string, so the crawl is split into
+# disjoint star ranges ("shards"), each paged with its own cursor
+SEARCH_RESULT_CAP = 1000
+MIN_STARS = 2 # Matches the original "stars:>1" search
+# An over-cap shard is split into this many times as many pieces as its repositoryCount strictly needs
+SPLIT_OVERSAMPLING = 2
+# Number of aliased search connections packed into a single GraphQL request
+SHARDS_PER_REQUEST = 4
+# Sized for the concurrent fetch workers, which all share one session
+HTTP_POOL_SIZE = 32
+MAX_HTTP_RETRIES = 5
+REQUEST_TIMEOUT = 30 # Seconds
+# Fetched batches waiting for the database writer thread
+WRITE_QUEUE_SIZE = 4
+# Upper bound on repositories remembered for in-crawl de-duplication
+SEEN_REPOSITORIES_LIMIT = 200000
+# GitHub charges one point per 100 requested nodes, rounded up to at least one per query
+EXPECTED_QUERY_COST = 1
+# The crawl stops once this many batches in a row fail to save
+MAX_WRITE_FAILURES = 3
+# A shard whose page fails or comes back null this many times in a row is given up on
+MAX_SHARD_FAILURES = 3
+FAILED_REQUEST_BACKOFF = 10 # Seconds a worker waits after a request fails outright
+
+# (low, high) star range; high is None for the open-ended top range
+Shard = Tuple[int, Optional[int]]
+# Queued shard: (priority, shard, cursor to resume from, consecutive failed fetches)
+ShardTask = Tuple[int, Shard, Optional[str], int]
+# A repository node as returned by the search query
+Repository = Dict[str, Any]
+# (id, owner, name, url, stars), in repositories_stage column order
+RepositoryRow = Tuple[str, str, str, str, int]
+
+
+def build_search_query(shard_count: int) -> str:
+    """Builds a GraphQL query with one aliased search connection (s0, s1, ...) per shard."""
+    variable_defs = ", ".join(["$batchSize: Int!"] + [f"$q{i}: String!, $c{i}: String" for i in range(shard_count)])
+    searches = "".join(
+        """
+          s%d: search(query: $q%d, type: REPOSITORY, first: $batchSize, after: $c%d) {
+            repositoryCount
+            pageInfo {
+              endCursor
+              hasNextPage
+            }
+            nodes {
+              ... on Repository {
+                id
+                name
+                url
+                stargazerCount
+                owner {
+                  login
+                }
+              }
+            }
+          }""" % (i, i, i)
+        for i in range(shard_count)
+    )
+    return """
+        query (%s) {
+          rateLimit {
+            limit
+            cost
+            remaining
+            resetAt
+          }%s
+        }
+    """ % (variable_defs, searches)
+
+
+def star_range_shards(min_stars: int = MIN_STARS, max_stars: int = 100000, growth: float = 1.5) -> List[Shard]:
+    """
+    Splits the star range into exponentially growing (low, high) buckets, e.g. (2, 2), (3, 3), (4, 5), ...
+    The last bucket is open-ended (high is None).
+    """
+    shards: List[Shard] = []
+    low = min_stars
+    while low < max_stars:
+        high = min(max(low, int(low * growth) - 1), max_stars - 1)
+        shards.append((low, high))
+        low = high + 1
+    shards.append((max_stars, None))
+    return shards
+
+
+def shard_search_query(shard: Shard) -> str:
+    """Returns the GitHub search query string for a (low, high) star range shard."""
+    low, high = shard
+    if high is None:
+        return f"stars:>={low}"
+    return f"stars:{low}..{high}"
+
+
+def split_shard(shard: Shard, pieces: int = 2) -> Optional[List[Shard]]:
+    """
+    Splits a shard into up to `pieces` contiguous star ranges of equal width, or returns None if it
+    covers a single star count. An open-ended shard is split in two at double its lower bound.
+    """
+    low, high = shard
+    if high is None:
+        return [(low, low * 2 - 1), (low * 2, None)]
+    if high == low:
+        return None
+    pieces = min(pieces, high - low + 1)
+    bounds = [low + (high - low + 1) * k // pieces for k in range(pieces + 1)]
+    return [(bounds[k], bounds[k + 1] - 1) for k in range(pieces)]
+
+
+# Built once at import; only the variables change between requests
+SEARCH_QUERIES = {shard_count: build_search_query(shard_count) for shard_count in range(1, SHARDS_PER_REQUEST + 1)}
+
+
+class TokenBucket:
+    """Thread-safe token bucket that spreads GraphQL point usage evenly across the hourly budget."""
+
+    def __init__(self, points_per_hour: int = 5000, capacity: int = 100) -> None:
+        self.rate: float = points_per_hour / 3600 # Points refilled per second
+        self.capacity: float = float(capacity)
+        self.tokens: float = float(capacity)
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, cost: int = EXPECTED_QUERY_COST) -> None:
+        """Blocks until `cost` points are available, then spends them."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait_time = (cost - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def reconcile(self, rate_limit: Dict[str, Any], expected_cost: int = EXPECTED_QUERY_COST) -> None:
+        """Corrects the bucket using the rateLimit object GitHub returned with a response."""
+        with self._lock:
+            self._refill()
+            self.rate = rate_limit["limit"] / 3600
+            self.tokens += expected_cost - rate_limit["cost"]
+            # Never let the bucket believe there is more budget left than GitHub reports
+            self.tokens = min(self.tokens, rate_limit["remaining"])
+
+
 class GitHubCrawler:
-    def __init__(self):
+    def __init__(self) -> None:
         self.github_token = os.getenv("GITHUB_TOKEN")
         if not self.github_token:
             raise ValueError("GITHUB_TOKEN environment variable not set.")
@@ -27,34 +184,63 @@ class GitHubCrawler:
         }
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        retry = Retry(
+            total=MAX_HTTP_RETRIES,
+            backoff_factor=1,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=frozenset({"POST"}), # GraphQL queries are read-only, so retrying POST is safe
+            raise_on_status=False, # Hand the final response back so raise_for_status reports it
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        self.session.mount("https://", adapter)
         self.collected_repos_count = 0
+        self.conn: Optional[psycopg.Connection[Any]] = None
+        # Shared deadline (epoch seconds) that every worker waits out before its next request
+        self._paused_until = 0.0
+        self._pause_lock = threading.Lock()
+        self._stop_crawl = threading.Event()
+        # Set by the writer when it gives up on the database, and raised once the crawl has wound down
+        self._write_error: Optional[Exception] = None
+        self._rate_limiter = TokenBucket()
+        # LRU of repository id -> last staged row, used to skip re-staging unchanged duplicates
+        self._seen_repositories: "OrderedDict[str, RepositoryRow]" = OrderedDict()
 
-    def _handle_rate_limit(self, headers_or_data):
+    def _handle_rate_limit(self, headers_or_data: Mapping[str, Any]) -> bool:
         """Calculates wait time based on rate limit reset and sleeps."""
-        reset_time = None
+        reset_time: Optional[int] = None
         if isinstance(headers_or_data, dict): # GraphQL rateLimit data
             reset_at_str = headers_or_data.get("resetAt")
             if reset_at_str:
                 # GitHub returns ISO 8601 format, e.g., "2023-11-20T12:34:56Z"
                 # Need to replace 'Z' with '+00:00' for fromisoformat to work with Python < 3.11 for UTC
-                reset_time_dt = datetime.fromisoformat(reset_at_str.replace("Z", "+00:00"))
-                reset_time = reset_time_dt.timestamp()
+                reset_time = int(datetime.fromisoformat(reset_at_str.replace("Z", "+00:00")).timestamp())
         else: # HTTP Headers
-            reset_time = headers_or_data.get("X-RateLimit-Reset")
-            if reset_time:
-                reset_time = int(reset_time)
-
-        if reset_time:
-            now = time.time()
-            wait_time = max(0, reset_time - now + 5) # Add a buffer of 5 seconds
-            print(f"Rate limit will reset at {time.ctime(reset_time)}. Waiting for {int(wait_time)} seconds.")
-            time.sleep(wait_time)
-        else:
-            print("Could not determine rate limit reset time. Waiting for 60 seconds as a precaution.")
-            time.sleep(60)
+            reset_header = headers_or_data.get("X-RateLimit-Reset")
+            if reset_header:
+                reset_time = int(reset_header)
+
+        with self._pause_lock:
+            # Only the first worker to hit the limit schedules the wait; the others share its deadline
+            if self._paused_until <= time.time():
+                if reset_time:
+                    self._paused_until = float(reset_time + 5) # Add a buffer of 5 seconds
+                    print(f"Rate limit will reset at {time.ctime(reset_time)}. Waiting for {int(max(0, self._paused_until - time.time()))} seconds.")
+                else:
+                    self._paused_until = time.time() + 60
+                    print("Could not determine rate limit reset time. Waiting for 60 seconds as a precaution.")
+        self._wait_for_rate_limit_reset()
         return True # Indicate that a wait occurred
 
-    def _check_graphql_response_for_errors_and_ratelimit(self, data, response_headers):
+    def _wait_for_rate_limit_reset(self) -> None:
+        """Blocks until the shared rate limit pause, if any, has passed."""
+        while True:
+            with self._pause_lock:
+                wait_time = self._paused_until - time.time()
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    def _check_graphql_response_for_errors_and_ratelimit(self, data: Dict[str, Any], response_headers: Mapping[str, str]) -> bool:
         """
         Checks a parsed GraphQL response for errors or rate limit warnings.
         Returns True if a retry is needed due to rate limiting, False otherwise.
@@ -70,27 +256,32 @@ class GitHubCrawler:
         if "data" in data and "rateLimit" in data["data"]:
             rate_limit = data["data"]["rateLimit"]
             print(f"Rate Limit: Cost={rate_limit['cost']}, Remaining={rate_limit['remaining']}, Reset At={rate_limit['resetAt']}")
-            # Proactive rate limit handling: wait if approaching limit
-            if rate_limit["remaining"] < rate_limit["cost"] + 10: # Keep a buffer
-                print("Approaching rate limit. Waiting for reset...")
-                return self._handle_rate_limit(rate_limit) # Pass GraphQL data for reset time
+            # Proactive pacing is done by the token bucket; waiting for the reset is only a fallback
+            # for when the budget is actually exhausted
+            self._rate_limiter.reconcile(rate_limit)
+            if rate_limit["remaining"] < rate_limit["cost"]:
+                print("Rate limit exhausted. Waiting for reset before the next request...")
+                self._handle_rate_limit(rate_limit) # Pass GraphQL data for reset time
+                # This response is still valid, so no retry is needed
         return False # No retry needed
 
-    def _execute_query(self, query, variables=None):
-        """Executes a GraphQL query with rate limit handling and retries."""
-        retries = 0
-        max_retries = 5 # Limit the number of retries for connection/timeout errors
-
-        while retries < max_retries:
+    def _execute_query(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Executes a GraphQL query with rate limit handling.
+        Connection errors, timeouts and 5xx responses are retried with backoff by the session's adapter.
+        """
+        while True:
             try:
-                response = self.session.post(self.api_url, json={"query": query, "variables": variables})
+                self._wait_for_rate_limit_reset() # Pause while a rate limit reset is pending
+                self._rate_limiter.acquire()
+                # Serialize with orjson rather than letting requests encode the body with the stdlib json module
+                body = orjson.dumps({"query": query, "variables": variables})
+                response = self.session.post(self.api_url, data=body, timeout=REQUEST_TIMEOUT)
                 response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                data = response.json()
+                data: Dict[str, Any] = orjson.loads(response.content) # Faster than response.json() and skips its encoding detection
 
                 if self._check_graphql_response_for_errors_and_ratelimit(data, response.headers):
-                    # Rate limit handled, retry the request
-                    retries = 0 # Reset retries after a successful wait
-                    continue
+                    continue # Rate limit handled, retry the request
 
                 return data # Return data if no errors or rate limits requiring retry
 
@@ -101,37 +292,24 @@ class GitHubCrawler:
                 elif e.response.status_code == 403: # Forbidden, often due to rate limits
                     print("Forbidden. Possible rate limit. Waiting for reset...")
                     if self._handle_rate_limit(e.response.headers):
-                        retries = 0 # Reset retries after a successful wait
                         continue # Retry after handling rate limit
                     else:
                         print("Failed to handle 403 (Forbidden) error. Aborting.")
                         raise # Re-raise if rate limit couldn't be handled
                 else:
-                    print(f"Unhandled HTTP error, retrying in 10 seconds (attempt {retries + 1}/{max_retries})...")
-                    retries += 1
-                    time.sleep(10)
-                    continue # Retry for other HTTP errors
-
-            except requests.exceptions.ConnectionError as e:
-                print(f"Connection error occurred: {e}. Retrying in 10 seconds (attempt {retries + 1}/{max_retries})...")
-                retries += 1
-                time.sleep(10)
-                continue
-            except requests.exceptions.Timeout as e:
-                print(f"Timeout error occurred: {e}. Retrying in 10 seconds (attempt {retries + 1}/{max_retries})...")
-                retries += 1
-                time.sleep(10)
-                continue
+                    print("Unhandled HTTP error. Aborting query.")
+                    return None
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                print(f"Network error occurred after {MAX_HTTP_RETRIES} retries: {e}. Aborting query.")
+                return None
             except Exception as e:
                 print(f"An unexpected error occurred: {e}")
                 raise
 
-        print(f"Max retries ({max_retries}) reached. Aborting query.")
-        return None # Return None if max retries exceeded
-
-    def _get_db_connection(self):
+    def _get_db_connection(self) -> "psycopg.Connection[Any]":
         """Establishes a connection to the PostgreSQL database."""
-        return psycopg2.connect(
+        return psycopg.connect(
             host=self.db_host,
             dbname=self.db_name,
             user=self.db_user,
@@ -139,95 +317,253 @@ class GitHubCrawler:
             port=self.db_port
         )
 
-    def _save_repositories(self, repositories):
-        """Saves a list of repositories to the database using UPSERT."""
+    def _ensure_conn(self) -> "psycopg.Connection[Any]":
+        """Returns the crawler's database connection, opening or reopening it as needed."""
+        conn = self.conn
+        if conn is None or conn.closed:
+            conn = self.conn = self._get_db_connection()
+        return conn
+
+    def close(self) -> None:
+        """Closes the database connection if one is open."""
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+    def _save_repositories(self, repositories: List[Repository], retry_on_disconnect: bool = True) -> int:
+        """
+        Stages a list of repositories with COPY; they are merged into repositories by _merge_staged_repositories.
+        Repositories already staged with identical values are skipped. Returns the number of rows staged;
+        database errors are raised after rolling back.
+        """
+        rows: Dict[str, RepositoryRow] = {} # Keyed by id, which also collapses duplicates within the batch
+        for repo in repositories:
+            try:
+                row = (repo["id"], repo["owner"]["login"], repo["name"], repo["url"], repo["stargazerCount"])
+            except (KeyError, TypeError):
+                # Search can return null or partial nodes (e.g. for repositories hidden mid-crawl); skip just those
+                print(f"Skipping malformed repository node: {repo}")
+                continue
+            if self._seen_repositories.get(row[0]) == row:
+                self._seen_repositories.move_to_end(row[0])
+            else:
+                rows[row[0]] = row
+        if not rows:
+            print(f"No new or changed repositories in this batch of {len(repositories)}.")
+            return 0
+
         conn = None
         try:
-            conn = self._get_db_connection()
-            cur = conn.cursor()
-            for repo in repositories:
-                repo_id = repo["id"]
-                owner = repo["owner"]["login"]
-                name = repo["name"]
-                url = repo["url"]
-                stars = repo["stargazerCount"]
-
-                upsert_query = """
-                    INSERT INTO repositories (id, owner, name, url, stars)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        owner = EXCLUDED.owner,
-                        name = EXCLUDED.name,
-                        url = EXCLUDED.url,
-                        stars = EXCLUDED.stars,
-                        updated_at = NOW();
-                """
-                cur.execute(upsert_query, (repo_id, owner, name, url, stars))
+            conn = self._ensure_conn()
+            with conn.cursor() as cur:
+                # COPY into the UNLOGGED staging table: no WAL, no indexes and no conflict checks per row
+                with cur.copy("COPY repositories_stage (id, owner, name, url, stars) FROM STDIN") as copy:
+                    for row in rows.values():
+                        copy.write_row(row)
             conn.commit()
-            cur.close()
-            print(f"Saved {len(repositories)} repositories to the database.")
-        except (Exception, psycopg2.DatabaseError) as error:
+            # Only remember rows once they are committed, so a failed batch is not skipped when it comes around again
+            for repo_id, row in rows.items():
+                self._seen_repositories[repo_id] = row
+                self._seen_repositories.move_to_end(repo_id)
+            while len(self._seen_repositories) > SEEN_REPOSITORIES_LIMIT:
+                self._seen_repositories.popitem(last=False)
+            print(f"Staged {len(rows)} repositories in the database ({len(repositories) - len(rows)} duplicate or malformed nodes skipped).")
+            return len(rows)
+        except psycopg.OperationalError as error:
+            # The long-lived connection went away: drop it and retry the batch once on a fresh one
+            print(f"Database connection error while saving repositories: {error}")
+            self.close()
+            if retry_on_disconnect:
+                return self._save_repositories(repositories, retry_on_disconnect=False)
+            raise
+        except (Exception, psycopg.DatabaseError) as error:
             print(f"Error saving repositories to DB: {error}")
             if conn:
                 conn.rollback()
-        finally:
-            if conn:
-                conn.close()
-
-    def crawl_repositories(self, target_count=100000, batch_size=100):
-        """Crawls GitHub for repositories and saves them to the database."""
-        query = """
-            query ($cursor: String) {
-              rateLimit {
-                cost
-                remaining
-                resetAt
-              }
-              search(query: "stars:>1", type: REPOSITORY, first: %s, after: $cursor) {
-                pageInfo {
-                  endCursor
-                  hasNextPage
-                }
-                nodes {
-                  ... on Repository {
-                    id
-                    name
-                    url
-                    stargazerCount
-                    owner {
-                      login
-                    }
-                  }
-                }
-              }
-            }
-        """ % batch_size
+            raise # Let the writer decide whether to keep crawling
 
-        next_cursor = None
-        while self.collected_repos_count < target_count:
-            print(f"Collected {self.collected_repos_count}/{target_count} repositories. Fetching next batch...")
-            variables = {"cursor": next_cursor}
-            result = self._execute_query(query, variables)
+    def _merge_staged_repositories(self) -> None:
+        """Merges the staging table into repositories with a single set-based UPSERT, then empties it."""
+        conn = None
+        try:
+            conn = self._ensure_conn()
+            merge_query = """
+                INSERT INTO repositories (id, owner, name, url, stars)
+                -- A repository can be staged more than once; keep the most recently staged copy
+                SELECT DISTINCT ON (id) id, owner, name, url, stars
+                FROM repositories_stage
+                ORDER BY id, crawled_at DESC
+                ON CONFLICT (id) DO UPDATE SET
+                    owner = EXCLUDED.owner,
+                    name = EXCLUDED.name,
+                    url = EXCLUDED.url,
+                    stars = EXCLUDED.stars,
+                    updated_at = NOW()
+                -- Skip the write entirely for repositories that have not changed since the last crawl
+                WHERE repositories.stars IS DISTINCT FROM EXCLUDED.stars
+                   OR repositories.name IS DISTINCT FROM EXCLUDED.name
+                   OR repositories.url IS DISTINCT FROM EXCLUDED.url
+                   OR repositories.owner IS DISTINCT FROM EXCLUDED.owner;
+            """
+            with conn.cursor() as cur:
+                cur.execute(merge_query)
+                merged = cur.rowcount
+                cur.execute("TRUNCATE repositories_stage;")
+            conn.commit()
+            print(f"Merged {merged} new or changed repositories into the database.")
+        except (Exception, psycopg.DatabaseError) as error:
+            print(f"Error merging staged repositories: {error}")
+            if conn and not conn.closed:
+                conn.rollback()
+
+    def _requeue_shard(self, shard_queue: "queue.PriorityQueue[ShardTask]", shard: Shard, cursor: Optional[str], failures: int) -> None:
+        """Queues a shard to be crawled from cursor, unless it has already failed MAX_SHARD_FAILURES times in a row."""
+        if failures >= MAX_SHARD_FAILURES:
+            print(f"Giving up on shard '{shard_search_query(shard)}' after {failures} failed attempts.")
+            return
+        # Most-starred shards first; star ranges are disjoint, so the priority never ties
+        shard_queue.put((-shard[0], shard, cursor, failures))
 
-            if not result or "data" not in result or "search" not in result["data"]:
-                print("Failed to fetch data or no more results.")
+    def _crawl_shards(
+        self,
+        shard_queue: "queue.PriorityQueue[ShardTask]",
+        batches: "queue.Queue[Optional[List[Repository]]]",
+        batch_size: int,
+    ) -> None:
+        """
+        Worker loop: pages through shards taken from shard_queue, SHARDS_PER_REQUEST at a time,
+        and puts each fetched list of repositories on batches. A shard whose first page reports
+        more results than search can return is split into SPLIT_OVERSAMPLING times as many
+        equal-width pieces as its repositoryCount needs (an open-ended shard in two), and the
+        pieces are queued instead.
+        """
+        # (low, high) star range -> (cursor for the next page of that shard, consecutive failed fetches)
+        active_shards: Dict[Shard, Tuple[Optional[str], int]] = {}
+        while not self._stop_crawl.is_set():
+            while len(active_shards) < SHARDS_PER_REQUEST:
+                try:
+                    _, shard, cursor, failures = shard_queue.get_nowait()
+                except queue.Empty:
+                    break
+                active_shards[shard] = (cursor, failures)
+            if not active_shards:
                 break
 
-            search_data = result["data"]["search"]
-            repositories = search_data["nodes"]
-            page_info = search_data["pageInfo"]
+            shards = list(active_shards.items())
+            query = SEARCH_QUERIES[len(shards)]
+            variables: Dict[str, Any] = {"batchSize": batch_size}
+            for i, (shard, (cursor, _)) in enumerate(shards):
+                variables[f"q{i}"] = shard_search_query(shard)
+                variables[f"c{i}"] = cursor
+
+            result = self._execute_query(query, variables)
+
+            if not result or not result.get("data"):
+                # Hand the shards back with their cursors so no progress is lost, then back off and carry on
+                print(f"Failed to fetch data for shards {[shard_search_query(shard) for shard in active_shards]}. Requeueing them.")
+                for shard, (cursor, failures) in shards:
+                    self._requeue_shard(shard_queue, shard, cursor, failures + 1)
+                active_shards.clear()
+                self._stop_crawl.wait(FAILED_REQUEST_BACKOFF)
+                continue
+
+            repositories: List[Repository] = []
+            for i, (shard, (cursor, failures)) in enumerate(shards):
+                search_data = result["data"].get(f"s{i}")
+                if not search_data:
+                    # GitHub nulls an alias on partial errors such as search timeouts; retry it from the same cursor
+                    print(f"No search results returned for shard '{shard_search_query(shard)}'. Requeueing it.")
+                    del active_shards[shard]
+                    self._requeue_shard(shard_queue, shard, cursor, failures + 1)
+                    continue
+
+                if cursor is None and search_data["repositoryCount"] > SEARCH_RESULT_CAP:
+                    # Results bunch up at the low end of a star range, so split into more pieces than
+                    # the count alone suggests; each piece is probed again and split further if needed
+                    pieces = SPLIT_OVERSAMPLING * -(-search_data["repositoryCount"] // SEARCH_RESULT_CAP)
+                    sub_shards = split_shard(shard, pieces)
+                    if sub_shards:
+                        # The pieces are crawled from their first page, so this page is dropped
+                        print(f"Shard '{shard_search_query(shard)}' has {search_data['repositoryCount']} results. Splitting it into {len(sub_shards)}.")
+                        for sub_shard in sub_shards:
+                            self._requeue_shard(shard_queue, sub_shard, None, 0)
+                        del active_shards[shard]
+                        continue
+                    print(f"Shard '{shard_search_query(shard)}' has {search_data['repositoryCount']} results but cannot be split. Only the first {SEARCH_RESULT_CAP} will be crawled.")
+
+                repositories.extend(search_data["nodes"])
+                page_info = search_data["pageInfo"]
+                if page_info["hasNextPage"]:
+                    active_shards[shard] = (page_info["endCursor"], 0)
+                else:
+                    del active_shards[shard]
 
             if repositories:
-                self._save_repositories(repositories)
-                self.collected_repos_count += len(repositories)
-            else:
-                print("No repositories found in the current batch.")
+                batches.put(repositories)
 
-            if not page_info["hasNextPage"] or self.collected_repos_count >= target_count:
-                print("No more pages or target count reached.")
-                break
-            next_cursor = page_info["endCursor"]
+    def _writer_loop(self, batches: "queue.Queue[Optional[List[Repository]]]", target_count: int) -> None:
+        """
+        Writer thread: saves batches from the queue until it receives the None sentinel.
+        Stops the crawl after MAX_WRITE_FAILURES failed batches in a row, since fetching more is pointless then.
+        """
+        consecutive_failures = 0
+        while True:
+            repositories = batches.get()
+            if repositories is None:
+                return
+            if self.collected_repos_count >= target_count:
+                continue # Drain batches that were in flight when the target was reached
+
+            if self._write_error is not None:
+                continue # Keep draining the queue so fetch workers never block on it
+
+            try:
+                self.collected_repos_count += self._save_repositories(repositories)
+                consecutive_failures = 0
+            except Exception as error:
+                consecutive_failures += 1
+                print(f"Failed to save a batch of {len(repositories)} repositories ({consecutive_failures}/{MAX_WRITE_FAILURES} in a row): {error}")
+                if consecutive_failures >= MAX_WRITE_FAILURES:
+                    print("Database writes keep failing. Stopping workers...")
+                    self._write_error = error
+                    self._stop_crawl.set()
+                continue
+            print(f"Collected {self.collected_repos_count}/{target_count} repositories.")
+            if self.collected_repos_count >= target_count:
+                print("Target count reached. Stopping workers...")
+                self._stop_crawl.set()
+
+    def crawl_repositories(self, target_count: int = 100000, batch_size: int = 100, workers: int = 4) -> None:
+        """Crawls GitHub for repositories with concurrent workers and saves them to the database."""
+        # Most-starred shards first, so a crawl cut short by target_count keeps the most popular repositories
+        shard_queue: "queue.PriorityQueue[ShardTask]" = queue.PriorityQueue()
+        for shard in star_range_shards():
+            self._requeue_shard(shard_queue, shard, None, 0)
+        # Bounded, so fetch workers block instead of buffering unboundedly if the database falls behind
+        batches: "queue.Queue[Optional[List[Repository]]]" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._stop_crawl.clear()
+        self._write_error = None
+
+        # Database writes run on their own thread so they overlap with the fetch workers' requests
+        writer = threading.Thread(target=self._writer_loop, args=(batches, target_count), daemon=True)
+        writer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self._crawl_shards, shard_queue, batches, batch_size) for _ in range(workers)]
+                try:
+                    for future in futures:
+                        future.result() # Re-raise any error from a worker, e.g. an invalid token
+                finally:
+                    self._stop_crawl.set()
+        finally:
+            batches.put(None)
+            writer.join()
+            # Merge whatever was staged, even if the crawl stopped early
+            self._merge_staged_repositories()
+            self.close()
 
+        if self._write_error is not None:
+            raise RuntimeError(f"Crawl stopped after {MAX_WRITE_FAILURES} failed database writes in a row: {self._write_error}")
         print(f"Finished crawling. Total repositories collected: {self.collected_repos_count}")
 
 if __name__ == "__main__":
@@ -236,6 +572,8 @@ if __name__ == "__main__":
         crawler.crawl_repositories()
     except ValueError as e:
         print(f"Configuration Error: {e}")
+        raise SystemExit(1)
     except Exception as e:
         print(f"An error occurred during crawling: {e}")
+        raise SystemExit(1)
 